@@ -1,340 +1,1005 @@
+import argparse
+import atexit
 import os
+import posixpath
+import queue
 import json
+import logging
+import logging.handlers
 import fnmatch
+import re
+import shutil
+import socket
+import sqlite3
 import threading
 import time
 import stat
+import sys
 import types
-from contextlib import contextmanager
+from collections import OrderedDict, deque
+from functools import lru_cache, partial
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 import paramiko
 from inotify_simple import INotify, flags
 
+# All output goes through this logger. main() routes it via _log_queue to _log_listener,
+# which writes to stdout on its own thread so sync threads never block on terminal I/O.
+logger = logging.getLogger('remote_sync')
+_log_queue = queue.Queue()
+_log_handler = logging.StreamHandler(sys.stdout)
+_log_handler.setFormatter(logging.Formatter('%(message)s'))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_handler)
+
 # Default file extensions to include when 'source_code_only' is true
-SOURCE_CODE_EXTENSIONS = [
+SOURCE_CODE_EXTENSIONS = frozenset({
     '.py', '.js', '.html', '.css', '.scss', '.java', '.c', '.cpp', '.h',
     '.hpp', '.go', '.rs', '.php', '.rb', '.ts', '.tsx', '.jsx', '.json',
     '.yml', '.yaml', '.md', '.sh', '.xml', '.sql'
-]
+})
+
+# Local relative paths only need converting to '/' form on platforms with a different separator
+_NEEDS_SEP_FIX = os.sep != '/'
+
+# Uploads stream the local file in PUT_CHUNK_SIZE reads over a pipelined SFTP handle
+PUT_CHUNK_SIZE = 128 * 1024
+# Largest data payload per SSH_FXP_WRITE. OpenSSH's sftp-server drops the session on messages
+# over 256 KiB including headers and advertises 261120 (255 KiB) as its write limit.
+PUT_MAX_REQUEST_SIZE = 255 * 1024
+# Files at least this big are read in 1 MiB blocks (split into PUT_MAX_REQUEST_SIZE writes)
+# with a sequential-readahead hint
+PUT_LARGE_FILE_SIZE = 1024 * 1024
+PUT_LARGE_CHUNK_SIZE = 1024 * 1024
+
+# inotify events are collected until the tree has been quiet for EVENT_DEBOUNCE seconds
+# (or EVENT_MAX_DELAY has passed since the first one) and then applied as one batch
+EVENT_DEBOUNCE = 0.15
+EVENT_MAX_DELAY = 1.0
+
+# Kernel socket buffers for the SSH connection (config 'tcp_buffer_size'; 0 leaves the kernel
+# autotuning, which a fixed size disables) and SSH channel flow-control window, sized for
+# high bandwidth-delay links
+DEFAULT_TCP_BUFFER_SIZE = 0
+SSH_WINDOW_SIZE = 2 ** 27
+SSH_MAX_PACKET_SIZE = 32768
+
+# Where SyncCache keeps one SQLite file per config
+CACHE_DIR = os.path.expanduser('~/.remote_sync_cache')
+
+# inotify event -> pending operation, keyed by (is directory, event kind). Combinations
+# without an entry (e.g. MODIFY on a directory, DELETE_SELF) are ignored.
+_CREATE_MASK = flags.CREATE | flags.MOVED_TO
+_DELETE_MASK = flags.DELETE | flags.MOVED_FROM
+_EVENT_OPS = {
+    (True, 'create'): 'mkdir',
+    (False, 'create'): 'upload',
+    (False, 'modify'): 'modify',
+    (True, 'delete'): 'rmdir',
+    (False, 'delete'): 'remove',
+}
+
+# Number of SFTP channels opened on the SSH transport for parallel scans and uploads
+DEFAULT_SFTP_CHANNELS = 8
+
+
+def _remote_join(remote_base, rel_path):
+    """Joins a local relative path onto a remote (POSIX) base path."""
+    return posixpath.join(remote_base, rel_path.replace(os.sep, '/') if _NEEDS_SEP_FIX else rel_path)
+
+
+@lru_cache(maxsize=1024)
+def _compiled(pattern):
+    return re.compile(fnmatch.translate(pattern))
+
+
+def _literal_runs(pattern):
+    """Split an fnmatch pattern into the literal substrings every match must contain."""
+    runs, run = [], ''
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        i += 1
+        if c in '*?':
+            runs.append(run)
+            run = ''
+        elif c == '[':
+            # Same bracket scanning as fnmatch.translate; an unclosed '[' is a literal
+            j = i
+            if j < n and pattern[j] == '!':
+                j += 1
+            if j < n and pattern[j] == ']':
+                j += 1
+            while j < n and pattern[j] != ']':
+                j += 1
+            if j >= n:
+                run += c
+            else:
+                runs.append(run)
+                run = ''
+                i = j + 1
+        else:
+            run += c
+    runs.append(run)
+    return [run for run in runs if run]
+
+
+class ExcludeMatcher:
+    """Decides whether a relative path is excluded by one config's exclude patterns.
+
+    A path is excluded when it or its basename matches a pattern (fnmatch syntax) or, with
+    source_code_only, when it is a file without a SOURCE_CODE_EXTENSIONS extension.
+    Patterns without wildcards (e.g. '.git/', 'node_modules/') are kept in a frozenset and
+    matched by exact lookup of the path and its basename. The remaining patterns are
+    translated once and joined into a single regex, so a check costs at most two regex
+    matches regardless of how many patterns there are. Paths ending in '/' are
+    directories and are never excluded by the source_code_only filter.
+
+    Before the regex runs, the path is checked for the longest literal of each wildcard
+    pattern (e.g. '.log' for '*.log'); if none is present no pattern can match. The
+    prefilter is disabled when some pattern has no literal at all (e.g. '*').
+    """
+
+    def __init__(self, exclude_patterns):
+        self.patterns = list(exclude_patterns)
+        self.literal_names = frozenset(p for p in self.patterns if not any(c in p for c in '*?['))
+        wildcard_patterns = [p for p in self.patterns if p not in self.literal_names]
+        if len(wildcard_patterns) == 1:
+            self._re = _compiled(wildcard_patterns[0])
+        elif wildcard_patterns:
+            self._re = re.compile("|".join(f"(?:{fnmatch.translate(p)})" for p in wildcard_patterns))
+        else:
+            self._re = None
 
+        tokens = [max(_literal_runs(p), key=len, default='') for p in wildcard_patterns]
+        self._tokens = None if '' in tokens else tuple(set(tokens))
 
-def is_excluded(path, exclude_patterns, source_code_only=False):
-    base_name = os.path.basename(path)
-    for pattern in exclude_patterns:
-        # Match against the full relative path or just the basename
-        path_to_check = path.replace(os.sep, '/')
-        if fnmatch.fnmatch(path_to_check, pattern) or fnmatch.fnmatch(base_name, pattern):
-            return True
-    if source_code_only:
-        if os.path.isdir(path):
-            return False  # Never exclude directories based on source_code_only
-        _, ext = os.path.splitext(base_name)
-        if ext.lower() not in SOURCE_CODE_EXTENSIONS:
+    def __call__(self, path, source_code_only=False):
+        path_to_check = path.replace(os.sep, '/') if _NEEDS_SEP_FIX else path
+        base_name = path_to_check.rpartition('/')[2]
+        if path_to_check in self.literal_names or base_name in self.literal_names:
             return True
-    return False
+        if self._re is not None and (self._tokens is None or any(t in path_to_check for t in self._tokens)):
+            if self._re.match(path_to_check) or self._re.match(base_name):
+                return True
+        if source_code_only and base_name:
+            i = base_name.rfind('.')
+            return i <= 0 or base_name[i:].lower() not in SOURCE_CODE_EXTENSIONS
+        return False
+
+
+def pipelined_put(sftp, local_path, remote_path):
+    """Uploads a file with pipelined writes: requests are queued without waiting for each ACK."""
+    with open(local_path, 'rb') as src, sftp.file(remote_path, 'wb') as dst:
+        dst.MAX_REQUEST_SIZE = PUT_MAX_REQUEST_SIZE
+        dst.set_pipelined(True)
+        if os.fstat(src.fileno()).st_size >= PUT_LARGE_FILE_SIZE:
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(src.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            shutil.copyfileobj(src, dst, PUT_LARGE_CHUNK_SIZE)
+        else:
+            while chunk := src.read(PUT_CHUNK_SIZE):
+                dst.write(chunk)
 
 
-@contextmanager
-def sftp_client(config):
-    """A context manager for establishing and closing an SFTP connection."""
-    ssh_client = None
-    sftp = None
-    try:
-        print(f"[{config['name']}] Connecting to {config['ssh_user']}@{config['ssh_host']}...")
-        ssh_client = paramiko.SSHClient()
-        ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        ssh_client.connect(
-            hostname=config['ssh_host'],
-            port=config.get('ssh_port', 22),
-            username=config['ssh_user'],
-            key_filename=os.path.expanduser(config['ssh_key_path']),
-            timeout=15
-        )
-        sftp = ssh_client.open_sftp()
-
-        if config.get('permissive', False):
-            # put
-            sftp._original_put = sftp.put
-
-            def put_with_permission(self, local_path, remote_path):
-                self._original_put(local_path, remote_path)
-                self.chmod(remote_path, 0o777)
-
-            sftp.put = types.MethodType(put_with_permission, sftp)
-
-            # mkdir
-            sftp._original_mkdir = sftp.mkdir
-
-            def mkdir_with_permission(self, remote_path):
-                self._original_mkdir(remote_path)
-                self.chmod(remote_path, 0o777)
-
-            sftp.mkdir = types.MethodType(mkdir_with_permission, sftp)
-
-        print(f"[{config['name']}] SFTP connection established.")
-        yield sftp
-    except Exception as e:
-        print(f"[{config['name']}] SFTP Connection Error: {e}")
-        yield None
-    finally:
-        if sftp: sftp.close()
-        if ssh_client: ssh_client.close()
-        # print(f"[{config['name']}] SFTP connection closed.") # Less verbose
+def _prepare_sftp(sftp, config):
+    """Installs the pipelined put and, for permissive configs, the chmod wrappers on an SFTP client."""
+    sftp.get_channel().settimeout(None)
 
+    # put: queue writes without waiting for each ACK so bursts of small files overlap RTTs
+    sftp.put = types.MethodType(pipelined_put, sftp)
 
-def walk_remote(sftp, remote_path, exclude_patterns, source_code_only):
-    """Recursively walk a remote directory, yielding relative paths and attributes."""
-    remote_map = {}
+    if config.get('permissive', False):
+        # put
+        sftp._original_put = sftp.put
+
+        def put_with_permission(self, local_path, remote_path):
+            self._original_put(local_path, remote_path)
+            self.chmod(remote_path, 0o777)
+
+        sftp.put = types.MethodType(put_with_permission, sftp)
+
+        # mkdir
+        sftp._original_mkdir = sftp.mkdir
 
-    # Use a stack for iterative traversal instead of pure recursion
-    stack = [""]
+        def mkdir_with_permission(self, remote_path):
+            self._original_mkdir(remote_path)
+            self.chmod(remote_path, 0o777)
 
-    while stack:
-        current_rel_path = stack.pop()
-        current_remote_path = os.path.join(remote_path, current_rel_path).replace("\\", "/")
+        sftp.mkdir = types.MethodType(mkdir_with_permission, sftp)
 
+    return sftp
+
+
+def open_sftp_pool(sftp, config, size):
+    """Opens up to `size` SFTP channels in total on the SSH transport already used by `sftp`."""
+    transport = sftp.get_channel().get_transport()
+    pool = [sftp]
+    while len(pool) < size:
         try:
-            for attr in sftp.listdir_attr(current_remote_path):
-                rel_item_path = os.path.join(current_rel_path, attr.filename).replace("\\", "/")
-                is_dir = stat.S_ISDIR(attr.st_mode)
+            channel = paramiko.SFTPClient.from_transport(transport)
+        except paramiko.SSHException as e:
+            # Most likely the server's MaxSessions limit; carry on with the channels we have
+            logger.warning(f"[{config['name']}] Could not open SFTP channel {len(pool) + 1}/{size}: {e}")
+            break
+        if channel is None:
+            break
+        pool.append(_prepare_sftp(channel, config))
+    return pool
+
+
+def close_sftp_pool(pool):
+    """Closes the extra channels of a pool, leaving the primary SFTP client open."""
+    for sftp in pool[1:]:
+        sftp.close()
 
-                exclude_check_path = rel_item_path + '/' if is_dir else rel_item_path
-                if is_excluded(exclude_check_path, exclude_patterns, source_code_only and (not is_dir)):
-                    continue
 
-                remote_map[rel_item_path] = attr
-                if is_dir:
-                    stack.append(rel_item_path)
+def _socket_buffer_limit():
+    """Largest SO_SNDBUF/SO_RCVBUF the kernel grants, or None if it cannot be read."""
+    try:
+        limits = []
+        for name in ('wmem_max', 'rmem_max'):
+            with open(f'/proc/sys/net/core/{name}') as f:
+                limits.append(int(f.read()))
+        return min(limits)
+    except (OSError, ValueError):
+        return None
+
+
+def _open_socket(host, port, timeout, buffer_size):
+    """Connects a TCP socket with TCP_NODELAY and, before the handshake, enlarged buffers."""
+    if buffer_size:
+        limit = _socket_buffer_limit()
+        if limit is not None and buffer_size > limit:
+            # The kernel would silently cap the size and autotuning would stay off
+            logger.warning(f"tcp_buffer_size {buffer_size} exceeds net.core.wmem_max/rmem_max "
+                           f"({limit}); keeping the OS default buffers")
+            buffer_size = 0
+    error = None
+    for family, sock_type, proto, _, address in socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM):
+        sock = socket.socket(family, sock_type, proto)
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if buffer_size:
+                # Must be set before connect() for the window scale to be negotiated
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, buffer_size)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, buffer_size)
+            sock.settimeout(timeout)
+            sock.connect(address)
+            return sock
+        except OSError as e:
+            error = e
+            sock.close()
+    raise error or OSError(f"Could not resolve {host}")
+
+
+class SFTPConnection:
+    """A long-lived SSH transport and SFTP session for one sync config.
+
+    connect() hands back the cached SFTP client while the transport is alive and only
+    rebuilds the transport (a full key exchange) once it has died. `generation` is bumped
+    every time a new transport is established. get_pool() adds extra SFTP channels on
+    the same transport for parallel work.
+    """
+
+    KEEPALIVE_INTERVAL = 30
+
+    def __init__(self, config):
+        self.config = config
+        self.ssh_client = None
+        self.sftp = None
+        self.generation = 0
+        self._pool = []
+        self._pool_size = 0
+
+    @property
+    def transport(self):
+        return self.ssh_client.get_transport() if self.ssh_client else None
+
+    def is_active(self):
+        transport = self.transport
+        return transport is not None and transport.is_active()
+
+    def connect(self):
+        """Returns a ready SFTP client, reconnecting only if needed, or None if the connection failed."""
+        config = self.config
+        if self.is_active():
+            if self.sftp is not None and not self.sftp.get_channel().closed:
+                return self.sftp
+            # Transport is fine, only the SFTP channel went away
+            try:
+                self.sftp = _prepare_sftp(self.ssh_client.open_sftp(), config)
+                return self.sftp
+            except Exception as e:
+                logger.warning(f"[{config['name']}] Could not reopen SFTP session: {e}")
+
+        self.close()
+        try:
+            logger.info(f"[{config['name']}] Connecting to {config['ssh_user']}@{config['ssh_host']}...")
+            self.ssh_client = paramiko.SSHClient()
+            self.ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            sock = _open_socket(config['ssh_host'], config.get('ssh_port', 22), 15,
+                                config.get('tcp_buffer_size', DEFAULT_TCP_BUFFER_SIZE))
+            self.ssh_client.connect(
+                hostname=config['ssh_host'],
+                port=config.get('ssh_port', 22),
+                username=config['ssh_user'],
+                key_filename=os.path.expanduser(config['ssh_key_path']),
+                timeout=15,
+                sock=sock,
+                # zlib pays off for text; binary assets rarely compress, so only source-only configs default to it
+                compress=config.get('use_compression', config.get('source_code_only', False))
+            )
+            # Channels opened from here on (the SFTP session and its pool) get the larger window
+            self.transport.default_window_size = SSH_WINDOW_SIZE
+            self.transport.default_max_packet_size = SSH_MAX_PACKET_SIZE
+            # Keep NAT mappings alive while the worker sits idle between events
+            self.transport.set_keepalive(self.KEEPALIVE_INTERVAL)
+            self.sftp = _prepare_sftp(self.ssh_client.open_sftp(), config)
+        except Exception as e:
+            logger.error(f"[{config['name']}] SFTP Connection Error: {e}")
+            self.close()
+            return None
+
+        self.generation += 1
+        logger.info(f"[{config['name']}] SFTP connection established.")
+        return self.sftp
+
+    def get_pool(self, size):
+        """Returns up to `size` SFTP clients on the current transport, the first being self.sftp."""
+        if self.sftp is None or self.sftp.get_channel().closed:
+            # Fanning out around a dead primary would rebuild the same broken pool every call
+            if self.connect() is None:
+                raise OSError("SFTP session closed")
+        if (self._pool_size != size or not self._pool or self._pool[0] is not self.sftp
+                or any(channel.get_channel().closed for channel in self._pool)):
+            close_sftp_pool(self._pool)
+            self._pool = open_sftp_pool(self.sftp, self.config, max(1, size))
+            self._pool_size = size
+        return self._pool
+
+    def close(self):
+        close_sftp_pool(self._pool)
+        self._pool = []
+        if self.sftp: self.sftp.close()
+        if self.ssh_client: self.ssh_client.close()
+        self.sftp = None
+        self.ssh_client = None
+
+
+class SyncCache:
+    """Persistent record of the tree as it was after the last successful sync of a config.
+
+    When a fresh local scan matches the cache exactly, the initial sync can skip walking the
+    remote tree. Rows hold the local (mtime, size) of every synced path (NULL for
+    directories) plus the remote attributes when known. A fingerprint of the settings that
+    shape the sync result is stored alongside, so changing them forces a rescan.
+    Safe to use from several threads.
+    """
+
+    def __init__(self, config, directory=CACHE_DIR):
+        os.makedirs(directory, exist_ok=True)
+        file_name = re.sub(r'[^\w.-]', '_', config['name']) + '.sqlite'
+        self.path = os.path.join(directory, file_name)
+        self.fingerprint = json.dumps({
+            'local_path': config['local_path'],
+            'remote_path': config['remote_path'],
+            'ssh_host': config['ssh_host'],
+            'ssh_port': config.get('ssh_port', 22),
+            'source_code_only': config.get('source_code_only', False),
+            'exclude_patterns': config.get('exclude_patterns', []),
+            'delete': config.get('initial_sync', {}).get('delete', False),
+        }, sort_keys=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS files (rel_path TEXT PRIMARY KEY, is_dir INTEGER, "
+                         "mtime REAL, size INTEGER, remote_mtime REAL, remote_size INTEGER)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._db.commit()
+
+    def matches(self, local_map):
+        """True if the cache is valid for this config and describes exactly `local_map`."""
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta WHERE key = 'fingerprint'").fetchone()
+            if row is None or row[0] != self.fingerprint:
+                return False
+            cached = {rel_path: None if is_dir else (mtime, size)
+                      for rel_path, is_dir, mtime, size in
+                      self._db.execute("SELECT rel_path, is_dir, mtime, size FROM files")}
+        return cached == local_map
+
+    def replace(self, rows):
+        """Replaces the whole cache with (rel_path, local_stat, remote_mtime, remote_size) rows."""
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM files")
+            self._db.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                                 [(rel_path, local_stat is None, *(local_stat or (None, None)), r_mtime, r_size)
+                                  for rel_path, local_stat, r_mtime, r_size in rows])
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES ('fingerprint', ?)", (self.fingerprint,))
+
+    def record(self, rel_path, local_stat):
+        """Records a path just synced by an event; local_stat is (mtime, size) or None for a directory."""
+        mtime, size = local_stat or (None, None)
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, NULL, ?)",
+                             (rel_path, local_stat is None, mtime, size, size))
+
+    def forget(self, rel_path):
+        with self._lock:
+            self._db.execute("DELETE FROM files WHERE rel_path = ?", (rel_path,))
+
+    def invalidate(self):
+        """Forces the next initial sync to walk the remote tree."""
+        with self._lock:
+            self._db.execute("DELETE FROM meta WHERE key = 'fingerprint'")
+
+    def commit(self):
+        with self._lock:
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.commit()
+            self._db.close()
+
+
+def walk_remote(sftp, remote_path, matcher, source_code_only, pool=None):
+    """Recursively walk a remote directory, yielding relative paths and attributes.
+
+    With a pool of several SFTP channels, directories are listed concurrently (one
+    outstanding listdir per channel); listings are merged on the calling thread.
+    """
+    remote_map = {}
+
+    def list_dir(channel, current_rel_path):
+        current_remote_path = posixpath.join(remote_path, current_rel_path)
+        try:
+            return channel.listdir_attr(current_remote_path)
         except FileNotFoundError:
             # This can happen if a directory was deleted during the scan
-            print(f"Warning: Remote path not found during scan: {current_remote_path}")
-            pass
+            logger.warning(f"Warning: Remote path not found during scan: {current_remote_path}")
+            return []
+
+    def record(current_rel_path, attrs):
+        """Adds a listing to remote_map and returns the subdirectories to descend into."""
+        subdirs = []
+        for attr in attrs:
+            rel_item_path = posixpath.join(current_rel_path, attr.filename)
+            is_dir = stat.S_ISDIR(attr.st_mode)
+
+            # Excluded directories are dropped here, before they are ever queued for listing
+            exclude_check_path = rel_item_path + '/' if is_dir else rel_item_path
+            if matcher(exclude_check_path, source_code_only and (not is_dir)):
+                continue
+
+            remote_map[rel_item_path] = attr
+            if is_dir:
+                subdirs.append(rel_item_path)
+        return subdirs
+
+    if not pool or len(pool) < 2:
+        # Use a stack for iterative traversal instead of pure recursion
+        stack = [""]
+        while stack:
+            current_rel_path = stack.pop()
+            stack.extend(record(current_rel_path, list_dir(sftp, current_rel_path)))
+        return remote_map
+
+    idle_channels = queue.Queue()
+    for channel in pool:
+        idle_channels.put(channel)
+
+    def list_on_idle_channel(current_rel_path):
+        channel = idle_channels.get()
+        try:
+            return current_rel_path, list_dir(channel, current_rel_path)
+        finally:
+            idle_channels.put(channel)
+
+    with ThreadPoolExecutor(max_workers=len(pool)) as executor:
+        running = {executor.submit(list_on_idle_channel, "")}
+        while running:
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                for subdir in record(*future.result()):
+                    running.add(executor.submit(list_on_idle_channel, subdir))
 
     return remote_map
 
 
-def perform_initial_sync(sftp, config):
-    """Compares local and remote directories and syncs them."""
-    print(f"[{config['name']}] Starting initial sync...")
+def _scandir_rec(path, matcher, source_code_only, prefix=''):
+    """Recursively scan a local directory, yielding (rel_path, is_dir, stat_result or None).
+
+    Excluded directories are pruned before they are opened. Symlinked directories are
+    reported but not descended into, matching os.walk's default.
+    """
+    subdirs = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                rel_path = prefix + entry.name
+                try:
+                    is_dir = entry.is_dir()
+                    if is_dir:
+                        if matcher(rel_path + os.sep):
+                            continue
+                        yield rel_path, True, None
+                        if not entry.is_symlink():
+                            subdirs.append((entry.path, rel_path + os.sep))
+                    elif not matcher(rel_path, source_code_only):
+                        yield rel_path, False, entry.stat()
+                except FileNotFoundError:
+                    continue  # Entry might have been deleted during the scan
+    except OSError:
+        return  # Unreadable or vanished directory, skipped like os.walk does
+
+    for sub_path, sub_prefix in subdirs:
+        yield from _scandir_rec(sub_path, matcher, source_code_only, sub_prefix)
+
+
+def run_on_pool(pool, jobs, handler):
+    """Runs handler(sftp, job) for every job, spreading jobs over the pool's channels.
+
+    Jobs are bucketed by hash of their first element (the relative path) and each channel
+    works through its own bucket on a dedicated thread, so no channel is shared.
+    """
+    if len(pool) == 1 or len(jobs) <= 1:
+        for job in jobs:
+            handler(pool[0], job)
+        return
+
+    buckets = [[] for _ in pool]
+    for job in jobs:
+        buckets[hash(job[0]) % len(pool)].append(job)
+
+    def drain(sftp, bucket):
+        for job in bucket:
+            handler(sftp, job)
+
+    with ThreadPoolExecutor(max_workers=len(pool)) as executor:
+        futures = [executor.submit(drain, sftp, bucket) for sftp, bucket in zip(pool, buckets) if bucket]
+    for future in futures:
+        future.result()
+
+
+def ensure_dir(sftp, remote_dir, created):
+    """Makes sure a remote directory exists, creating missing ancestors first.
+
+    `created` is a set of directories known to exist; it is consulted before any request
+    and updated afterwards, so each directory costs at most one stat (plus a mkdir).
+    """
+    if remote_dir in created or remote_dir in ('', '/'):
+        return
+    try:
+        sftp.stat(remote_dir)
+    except IOError:
+        ensure_dir(sftp, posixpath.dirname(remote_dir), created)
+        try:
+            sftp.mkdir(remote_dir)
+        except IOError:
+            # Another channel may have created it in the meantime; fail only if it is still missing
+            sftp.stat(remote_dir)
+    created.add(remote_dir)
+
+
+def put_creating_dirs(sftp, local_path, remote_path, created):
+    """Uploads a file, creating its remote parent directories only if the first attempt needs them."""
+    try:
+        sftp.put(local_path, remote_path)
+    except FileNotFoundError:
+        remote_dir = posixpath.dirname(remote_path)
+        if remote_dir in created or not os.path.exists(local_path):
+            raise
+        ensure_dir(sftp, remote_dir, created)
+        sftp.put(local_path, remote_path)
+
+
+def _initial_upload(config, failed, created, sftp, upload):
+    """Applies one (rel_path, local_path, remote_path, action) entry of the initial sync.
+
+    action is 'mkdir', 'upload' or 'update'. The rel_path of a failed entry is added to
+    the `failed` set.
+    """
+    rel_path, local_full_path, remote_full_path, action = upload
+    if action == 'mkdir':
+        logger.info(f"[{config['name']}] Initial Sync: Creating dir -> {remote_full_path}")
+    elif action == 'update':
+        logger.info(f"[{config['name']}] Initial Sync: Updating modified file -> {remote_full_path}")
+    else:
+        logger.info(f"[{config['name']}] Initial Sync: Uploading new file -> {remote_full_path}")
+    try:
+        if action == 'mkdir':
+            ensure_dir(sftp, remote_full_path, created)
+        else:
+            put_creating_dirs(sftp, local_full_path, remote_full_path, created)
+    except Exception as e:
+        if action == 'mkdir':
+            logger.error(f"Error creating dir {remote_full_path}: {e}")
+        else:
+            logger.error(f"Error {'updating' if action == 'update' else 'uploading'} {remote_full_path}: {e}")
+        failed.add(rel_path)
+
+
+def perform_initial_sync(sftp, config, matcher, pool=None, cache=None, full_rescan=False):
+    """Compares local and remote directories and syncs them.
+
+    `pool` is an optional list of SFTP clients (see SFTPConnection.get_pool) used to scan
+    the remote tree and upload files in parallel. With a SyncCache, the remote walk is
+    skipped when the local tree is unchanged since the last sync, unless `full_rescan`.
+    """
+    logger.info(f"[{config['name']}] Starting initial sync...")
 
     local_base = os.path.expanduser(config['local_path'])
     remote_base = config['remote_path']
-    exclude_patterns = config.get('exclude_patterns', [])
     source_code_only = config.get('source_code_only', False)
     allow_delete = config.get('initial_sync', {}).get('delete', False)
+    pool = pool or [sftp]
 
-    # 1. Build map of local files
+    # 1. Build map of local files: rel_path -> (mtime, size), or None for directories
     local_map = {}
-    for root, dirs, files in os.walk(local_base, topdown=True):
-        # Filter directories in-place using the exclude patterns
-        dirs[:] = [d for d in dirs if
-                   not is_excluded(os.path.relpath(os.path.join(root, d), local_base) + os.sep, exclude_patterns,
-                                   False)]
-
-        for name in dirs:
-            full_path = os.path.join(root, name)
-            rel_path = os.path.relpath(full_path, local_base)
-            local_map[rel_path] = {'is_dir': True}
-
-        for name in files:
-            full_path = os.path.join(root, name)
-            rel_path = os.path.relpath(full_path, local_base)
-            if not is_excluded(rel_path, exclude_patterns, source_code_only):
-                try:
-                    stats = os.stat(full_path)
-                    local_map[rel_path] = {'mtime': stats.st_mtime, 'size': stats.st_size, 'is_dir': False}
-                except FileNotFoundError:
-                    continue  # File might have been deleted during the walk
+    for rel_path, is_dir, stats in _scandir_rec(local_base, matcher, source_code_only):
+        local_map[rel_path] = None if is_dir else (stats.st_mtime, stats.st_size)
+
+    if cache is not None and not full_rescan and cache.matches(local_map):
+        logger.info(f"[{config['name']}] Initial Sync: Local tree unchanged since last sync, skipping remote scan.")
+        logger.info(f"[{config['name']}] Initial sync completed.")
+        return
 
     # 2. Build map of remote files
-    remote_map = walk_remote(sftp, remote_base, exclude_patterns, source_code_only)
+    remote_map = walk_remote(sftp, remote_base, matcher, source_code_only, pool)
 
-    # 3. Determine differences
-    local_paths = set(local_map.keys())
-    remote_paths = set(remote_map.keys())
+    # 3. Determine differences (set operations straight on the key views, no intermediate sets)
+    local_paths = local_map.keys()
+    remote_paths = remote_map.keys()
 
     to_upload = local_paths - remote_paths
     to_delete = remote_paths - local_paths
-    to_check = local_paths.intersection(remote_paths)
+    to_check = local_paths & remote_paths
 
     # 4. Execute actions
-    # Create directories and upload files
-    # Sort to ensure parent directories are created first
-    for rel_path in sorted(list(to_upload)):
+    # New directories and files go out together; missing parents are created on demand by
+    # ensure_dir, seeded with every directory the remote scan already found
+    failed = set()
+    created = {remote_base.rstrip('/')}
+    created.update(_remote_join(remote_base, rel_path) for rel_path, attr in remote_map.items()
+                   if stat.S_ISDIR(attr.st_mode))
+    uploads = []
+    for rel_path in to_upload:
         local_full_path = os.path.join(local_base, rel_path)
-        remote_full_path = os.path.join(remote_base, rel_path).replace("\\", "/")
-        if local_map[rel_path]['is_dir']:
-            print(f"[{config['name']}] Initial Sync: Creating dir -> {remote_full_path}")
-            try:
-                sftp.mkdir(remote_full_path)
-            except Exception as e:
-                print(f"Error creating dir {remote_full_path}: {e}")
-        else:
-            print(f"[{config['name']}] Initial Sync: Uploading new file -> {remote_full_path}")
-            try:
-                sftp.put(local_full_path, remote_full_path)
-            except Exception as e:
-                print(f"Error uploading {remote_full_path}: {e}")
+        remote_full_path = _remote_join(remote_base, rel_path)
+        action = 'mkdir' if local_map[rel_path] is None else 'upload'
+        uploads.append((rel_path, local_full_path, remote_full_path, action))
 
     # Check for modified files
     for rel_path in to_check:
-        if local_map[rel_path]['is_dir']: continue  # Skip directories
-
         local_file_stat = local_map[rel_path]
+        if local_file_stat is None: continue  # Skip directories
+
+        local_mtime, local_size = local_file_stat
         remote_file_attr = remote_map[rel_path]
 
         # Compare modification time (with a 1-second tolerance) and size
-        if int(local_file_stat['mtime']) > remote_file_attr.st_mtime + 1 or local_file_stat[
-            'size'] != remote_file_attr.st_size:
+        if int(local_mtime) > remote_file_attr.st_mtime + 1 or local_size != remote_file_attr.st_size:
             local_full_path = os.path.join(local_base, rel_path)
-            remote_full_path = os.path.join(remote_base, rel_path).replace("\\", "/")
-            print(f"[{config['name']}] Initial Sync: Updating modified file -> {remote_full_path}")
-            try:
-                sftp.put(local_full_path, remote_full_path)
-            except Exception as e:
-                print(f"Error updating {remote_full_path}: {e}")
+            remote_full_path = _remote_join(remote_base, rel_path)
+            uploads.append((rel_path, local_full_path, remote_full_path, 'update'))
+
+    # Spread the uploads over several SFTP channels
+    run_on_pool(pool, uploads, partial(_initial_upload, config, failed, created))
 
     # Delete extra remote files and directories
     if allow_delete:
         # Sort in reverse to ensure files are deleted before their parent directories
         for rel_path in sorted(list(to_delete), reverse=True):
-            remote_full_path = os.path.join(remote_base, rel_path).replace("\\", "/")
+            remote_full_path = _remote_join(remote_base, rel_path)
             is_dir = stat.S_ISDIR(remote_map[rel_path].st_mode)
             if is_dir:
-                print(f"[{config['name']}] Initial Sync: Deleting extra dir -> {remote_full_path}")
+                logger.info(f"[{config['name']}] Initial Sync: Deleting extra dir -> {remote_full_path}")
                 try:
                     sftp.rmdir(remote_full_path)
                 except Exception as e:
-                    print(f"Error deleting dir {remote_full_path}: {e}")
+                    logger.error(f"Error deleting dir {remote_full_path}: {e}")
+                    failed.add(rel_path)
             else:
-                print(f"[{config['name']}] Initial Sync: Deleting extra file -> {remote_full_path}")
+                logger.info(f"[{config['name']}] Initial Sync: Deleting extra file -> {remote_full_path}")
                 try:
                     sftp.remove(remote_full_path)
                 except Exception as e:
-                    print(f"Error deleting file {remote_full_path}: {e}")
+                    logger.error(f"Error deleting file {remote_full_path}: {e}")
+                    failed.add(rel_path)
     else:
         if to_delete:
-            print(
+            logger.info(
                 f"[{config['name']}] Initial Sync: Found {len(to_delete)} extra remote item(s). Deletion is disabled in config.")
 
-    print(f"[{config['name']}] Initial sync completed.")
+    if cache is not None:
+        if failed:
+            # Something is still out of sync; make sure the next start walks the remote again
+            cache.invalidate()
+            cache.commit()
+        else:
+            uploaded = {upload[0] for upload in uploads}
+            rows = []
+            for rel_path, local_stat in local_map.items():
+                remote_attr = remote_map.get(rel_path)
+                if remote_attr is None or rel_path in uploaded:
+                    # Just created or uploaded: the remote size is the local one, its mtime is unknown
+                    rows.append((rel_path, local_stat, None, local_stat and local_stat[1]))
+                else:
+                    rows.append((rel_path, local_stat, remote_attr.st_mtime, remote_attr.st_size))
+            cache.replace(rows)
+
+    logger.info(f"[{config['name']}] Initial sync completed.")
 
 
-def sync_worker(config):
+def sync_worker(config, full_rescan=False):
     RECONNECT_DELAY = 30
     inotify = INotify()
     watch_flags = (flags.CREATE | flags.DELETE | flags.MODIFY | flags.MOVED_TO | flags.MOVED_FROM |
                    flags.DELETE_SELF | flags.MOVE_SELF)
     wd_map = {}
+    matcher = ExcludeMatcher(config.get('exclude_patterns', []))
+    source_code_only = config.get('source_code_only', False)
 
     def add_watch_recursively(path):
         if not os.path.exists(path): return
-        rel_path_from_base = os.path.relpath(path, config['local_path'])
+        rel_path_from_base = os.path.relpath(path, local_path)
         if rel_path_from_base == '.': rel_path_from_base = ''
-        if is_excluded(rel_path_from_base + '/', config.get('exclude_patterns', []),
-                       (not os.path.isdir(path)) and config.get('source_code_only', False)):
+        if matcher(rel_path_from_base + '/'):
             return
-        try:
-            wd = inotify.add_watch(path, watch_flags)
-            wd_map[wd] = path
-            for item in os.listdir(path):
-                child_path = os.path.join(path, item)
-                if os.path.isdir(child_path):
-                    add_watch_recursively(child_path)
-        except Exception as e:
-            print(f"[{config['name']}] Error adding watch for {path}: {e}")
+        # Breadth-first over os.scandir: no recursion limit, no extra stat per entry, and
+        # excluded subdirectories are skipped before they are ever opened
+        pending_dirs = deque([(path, rel_path_from_base)])
+        while pending_dirs:
+            dir_path, dir_rel_path = pending_dirs.popleft()
+            try:
+                wd = inotify.add_watch(dir_path, watch_flags)
+                wd_map[wd] = dir_path
+                with os.scandir(dir_path) as it:
+                    for entry in it:
+                        if not entry.is_dir(follow_symlinks=False):
+                            continue
+                        child_rel_path = os.path.join(dir_rel_path, entry.name)
+                        if not matcher(child_rel_path + '/'):
+                            pending_dirs.append((entry.path, child_rel_path))
+            except Exception as e:
+                logger.error(f"[{config['name']}] Error adding watch for {dir_path}: {e}")
+
+    def handle_mkdir(sftp, rel_path, event_path, remote_path):
+        logger.info(f"[{config['name']}] Event: Creating remote dir -> {remote_path}")
+        sftp.mkdir(remote_path)
+        if cache: cache.record(rel_path, None)
+
+    def handle_put(sftp, rel_path, event_path, remote_path):
+        # Stat before uploading so a write racing the upload is caught at the next start
+        stats = os.stat(event_path)
+        sftp.put(event_path, remote_path)
+        if cache: cache.record(rel_path, (stats.st_mtime, stats.st_size))
+
+    def handle_upload(sftp, rel_path, event_path, remote_path):
+        logger.info(f"[{config['name']}] Event: Uploading file -> {rel_path}")
+        handle_put(sftp, rel_path, event_path, remote_path)
+
+    def handle_modify(sftp, rel_path, event_path, remote_path):
+        logger.info(f"[{config['name']}] Event: MODIFIED -> {rel_path}")
+        handle_put(sftp, rel_path, event_path, remote_path)
+
+    def handle_rmdir(sftp, rel_path, event_path, remote_path):
+        logger.info(f"[{config['name']}] Event: Removing remote dir -> {remote_path}")
+        sftp.rmdir(remote_path)
+        if cache: cache.forget(rel_path)
+
+    def handle_remove(sftp, rel_path, event_path, remote_path):
+        logger.info(f"[{config['name']}] Event: Removing remote file -> {remote_path}")
+        sftp.remove(remote_path)
+        if cache: cache.forget(rel_path)
+
+    handlers = {'mkdir': handle_mkdir, 'upload': handle_upload, 'modify': handle_modify,
+                'rmdir': handle_rmdir, 'remove': handle_remove}
+
+    def apply_events(conn, batch):
+        def apply(sftp, entry):
+            rel_path, op, event_path, remote_path = entry
+            try:
+                handlers[op](sftp, rel_path, event_path, remote_path)
+            except IOError as e:
+                # A closed channel (e.g. the server's ChannelTimeout) fails every later operation
+                # too, even though the transport is still up
+                if not conn.is_active() or sftp.get_channel().closed:
+                    raise
+                # Keep applying the rest of the batch; one failed path should not drop the others
+                logger.error(f"[{config['name']}] Error applying {op} for {rel_path}: {e}")
+
+        if conn.sftp.get_channel().closed:
+            # The server closed the idle session; reopen it before the batch, and leave a full
+            # reconnect to the main loop so it runs the initial sync first
+            generation = conn.generation
+            if conn.connect() is None or conn.generation != generation:
+                raise OSError("SFTP session closed")
+
+        # Consecutive uploads go out concurrently over the channel pool; any other operation
+        # waits for the uploads queued before it and then runs on the main session, in order
+        pool = conn.get_pool(config.get('channels', DEFAULT_SFTP_CHANNELS))
+        uploads = []
+        for (rel_path, _), (op, event_path, remote_path, _) in batch.items():
+            entry = (rel_path, op, event_path, remote_path)
+            if op in ('upload', 'modify'):
+                uploads.append(entry)
+                continue
+            run_on_pool(pool, uploads, apply)
+            uploads = []
+            apply(conn.sftp, entry)
+        run_on_pool(pool, uploads, apply)
+        if cache: cache.commit()
 
     local_path = os.path.expanduser(config['local_path'])
     if not os.path.isdir(local_path):
-        print(f"[{config['name']}] ERROR: Local path '{local_path}' does not exist. Worker stopped.")
+        logger.error(f"[{config['name']}] ERROR: Local path '{local_path}' does not exist. Worker stopped.")
         return
 
     add_watch_recursively(local_path)
 
-    while True:
+    cache = None
+    if config.get('initial_sync', {}).get('enabled', False):
         try:
-            with sftp_client(config) as sftp:
-                if sftp is None:
-                    print(f"[{config['name']}] Connection failed. Retrying in {RECONNECT_DELAY} seconds...")
-                    time.sleep(RECONNECT_DELAY)
-                    continue
+            cache = SyncCache(config)
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"[{config['name']}] Sync cache unavailable, every start will rescan the remote: {e}")
 
-                # --- NEW: Call the initial sync function upon successful connection ---
+    conn = SFTPConnection(config)
+    synced_generation = 0
+    while True:
+        monitoring = False
+        try:
+            sftp = conn.connect()
+            if sftp is None:
+                logger.warning(f"[{config['name']}] Connection failed. Retrying in {RECONNECT_DELAY} seconds...")
+                time.sleep(RECONNECT_DELAY)
+                continue
+
+            # Run the initial sync once per newly established connection
+            if conn.generation != synced_generation:
                 if config.get('initial_sync', {}).get('enabled', False):
-                    perform_initial_sync(sftp, config)
+                    pool = conn.get_pool(config.get('channels', DEFAULT_SFTP_CHANNELS))
+                    perform_initial_sync(sftp, config, matcher, pool, cache, full_rescan)
                 else:
-                    print(f"[{config['name']}] Initial sync is disabled in config. Skipping.")
-
-                print(f"[{config['name']}] Now monitoring for file changes...")
-                while True:
-                    for event in inotify.read(timeout=1):
-                        wd = event.wd
-                        if wd not in wd_map: continue
-                        parent_dir_path = wd_map[wd]
-                        event_path = os.path.join(parent_dir_path, event.name)
-                        rel_path = os.path.relpath(event_path, local_path)
-                        remote_path = os.path.join(config['remote_path'], rel_path).replace("\\", "/")
-                        exclude_path_check = rel_path + ('/' if event.mask & flags.ISDIR else '')
-                        if is_excluded(exclude_path_check, config.get('exclude_patterns', []),
-                                       config.get('source_code_only', False)):
+                    logger.info(f"[{config['name']}] Initial sync is disabled in config. Skipping.")
+                synced_generation = conn.generation
+
+            logger.info(f"[{config['name']}] Now monitoring for file changes...")
+            monitoring = True
+            # (rel_path, 'delete' | 'create') -> (op, event_path, remote_path, created_in_batch);
+            # insertion order is kept so a directory's mkdir is applied before uploads of its
+            # children and a path's delete before its re-creation
+            pending = OrderedDict()
+            first_event_time = last_event_time = 0.0
+            # Hoisted out of the loop; bursts (e.g. git checkout) deliver thousands of events per read
+            read_events = inotify.read
+            join, relpath, monotonic = os.path.join, os.path.relpath, time.monotonic
+            remote_base = config['remote_path']
+            while True:
+                read_timeout = int(EVENT_DEBOUNCE * 1000) if pending else 1000
+                for event in read_events(timeout=read_timeout):
+                    mask = event.mask
+                    if mask & _CREATE_MASK:
+                        kind = 'create'
+                    elif mask & flags.MODIFY:
+                        kind = 'modify'
+                    elif mask & _DELETE_MASK:
+                        kind = 'delete'
+                    else:
+                        continue
+                    is_dir = bool(mask & flags.ISDIR)
+                    op = _EVENT_OPS.get((is_dir, kind))
+                    if op is None: continue
+
+                    parent_dir_path = wd_map.get(event.wd)
+                    if parent_dir_path is None: continue
+                    event_path = join(parent_dir_path, event.name)
+                    rel_path = relpath(event_path, local_path)
+                    if matcher(rel_path + '/' if is_dir else rel_path, source_code_only):
+                        continue
+                    remote_path = _remote_join(remote_base, rel_path)
+                    if op == 'mkdir':
+                        # Watch right away so events inside the new dir are not missed
+                        add_watch_recursively(event_path)
+
+                    if not pending:
+                        first_event_time = monotonic()
+                    last_event_time = monotonic()
+                    if op in ('rmdir', 'remove'):
+                        created = pending.pop((rel_path, 'create'), None)
+                        if (rel_path, 'delete') in pending or (created is not None and created[3]):
+                            # Already queued for deletion, or created and deleted within one
+                            # batch (editor temp files): nothing more to send
                             continue
-                        if event.mask & (flags.CREATE | flags.MOVED_TO):
-                            if event.mask & flags.ISDIR:
-                                print(f"[{config['name']}] Event: Creating remote dir -> {remote_path}")
-                                sftp.mkdir(remote_path)
-                                add_watch_recursively(event_path)
-                            else:
-                                print(f"[{config['name']}] Event: Uploading file -> {rel_path}")
-                                sftp.put(event_path, remote_path)
-                        elif event.mask & flags.MODIFY and not event.mask & flags.ISDIR:
-                            print(f"[{config['name']}] Event: MODIFIED -> {rel_path}")
-                            sftp.put(event_path, remote_path)
-                        elif event.mask & (flags.DELETE | flags.MOVED_FROM):
-                            if event.mask & flags.ISDIR:
-                                print(f"[{config['name']}] Event: Removing remote dir -> {remote_path}")
-                                sftp.rmdir(remote_path)
-                            else:
-                                print(f"[{config['name']}] Event: Removing remote file -> {remote_path}")
-                                sftp.remove(remote_path)
+                        pending[(rel_path, 'delete')] = (op, event_path, remote_path, False)
+                        continue
+                    previous = pending.get((rel_path, 'create'))
+                    if previous is not None:
+                        if op == 'modify' and previous[0] == 'upload':
+                            continue  # The pending upload already sends the latest content
+                        pending[(rel_path, 'create')] = (op, event_path, remote_path, previous[3])
+                        continue
+                    deleted = pending.get((rel_path, 'delete'))
+                    if op == 'mkdir' and deleted is not None and deleted[0] == 'rmdir':
+                        # Removed and recreated: the remote dir can stay, its children's own
+                        # events cover the contents
+                        del pending[(rel_path, 'delete')]
+                        continue
+                    # A new key lands after any pending delete of the same path, so the delete runs first
+                    pending[(rel_path, 'create')] = (op, event_path, remote_path,
+                                                     deleted is None and op in ('mkdir', 'upload'))
+
+                now = monotonic()
+                if pending and (now - last_event_time >= EVENT_DEBOUNCE or now - first_event_time >= EVENT_MAX_DELAY):
+                    batch, pending = pending, OrderedDict()
+                    apply_events(conn, batch)
 
         except (paramiko.ssh_exception.SSHException, EOFError, OSError) as e:
-            print(f"[{config['name']}] CRITICAL ERROR: Connection lost ({type(e).__name__}: {e}).")
-            print(f"[{config['name']}] Attempting to reconnect in {RECONNECT_DELAY} seconds...")
+            if monitoring and conn.is_active():
+                # An SFTP channel died mid-batch; keep the transport, reopen the session and resync
+                # to pick up the rest of the batch. Failures before monitoring (e.g. during the
+                # initial sync) still back off.
+                synced_generation = None
+                logger.warning(f"[{config['name']}] Operation failed ({type(e).__name__}: {e}). Resuming monitoring...")
+                continue
+            logger.error(f"[{config['name']}] CRITICAL ERROR: Connection lost ({type(e).__name__}: {e}).")
+            logger.info(f"[{config['name']}] Attempting to reconnect in {RECONNECT_DELAY} seconds...")
             time.sleep(RECONNECT_DELAY)
         except KeyboardInterrupt:
-            print(f"[{config['name']}] Shutting down worker...")
+            logger.info(f"[{config['name']}] Shutting down worker...")
             break
         except Exception as e:
-            print(f"[{config['name']}] An unexpected error occurred: {e}. Restarting connection logic...")
+            logger.error(f"[{config['name']}] An unexpected error occurred: {e}. Restarting connection logic...")
             time.sleep(RECONNECT_DELAY)
 
+    conn.close()
+    if cache: cache.close()
+
 
 def main():
-    """Loads configurations and starts a sync worker thread for each."""
+    """Parses the command line, starts the logging thread and runs the sync workers."""
+    parser = argparse.ArgumentParser(description="One-way realtime sync of local directories to remote hosts over SFTP.")
+    parser.add_argument('--full-rescan', action='store_true',
+                        help="Ignore the sync cache and always walk the remote tree during the initial sync.")
+    args = parser.parse_args()
+
+    logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    _log_listener.start()
+    # atexit runs after the interpreter has joined the (non-daemon) worker threads, so their
+    # last messages are still written out before the listener drains and stops
+    atexit.register(_log_listener.stop)
+    run(args)
+
+
+def run(args):
+    """Starts a sync worker thread for each enabled configuration and waits for them."""
     try:
         with open('config.json', 'r') as f:
             configs = json.load(f)
     except FileNotFoundError:
-        print("Error: config.json not found. Please create it.")
+        logger.error("Error: config.json not found. Please create it.")
         return
     except json.JSONDecodeError:
-        print("Error: Could not decode config.json. Please check its format.")
+        logger.error("Error: Could not decode config.json. Please check its format.")
         return
 
     threads = []
     for config in configs:
         if config.get('enabled', False):
-            thread = threading.Thread(target=sync_worker, args=(config,))
+            thread = threading.Thread(target=sync_worker, args=(config, args.full_rescan))
             threads.append(thread)
             thread.start()
 
-    print(f"Started {len(threads)} sync tasks.")
+    logger.info(f"Started {len(threads)} sync tasks.")
 
     try:
         for thread in threads:
             thread.join()
     except KeyboardInterrupt:
-        print("\nCtrl+C detected. Shutting down all sync threads.")
+        logger.info("Ctrl+C detected. Shutting down all sync threads.")
 
 
 if __name__ == '__main__':